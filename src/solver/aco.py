@@ -2,13 +2,137 @@ import sys
 import sqlite3
 import numpy as np
 import pandas as pd
+from numba import njit, prange
 from tqdm import tqdm
 import csv
 import os
 
 
+# Default SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+SQLITE_MAX_VARIABLES = 999
+
+
+# Everything but nnan/ninf, missing distances are inf
+FASTMATH_FLAGS = {'reassoc', 'contract', 'arcp', 'nsz', 'afn'}
+
+
+def _chunked(items, size):
+    """Yield consecutive slices of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@njit('Tuple((int64[:], float64))(float32[:, ::1], float32[:, ::1], float32[:, ::1], float64[::1], float64[::1], float64, float64, int64)',
+      cache=True, fastmath=FASTMATH_FLAGS)
+def _build_ant_tour(dist_mat, pheromone_alpha, inv_dist_beta, pall, lbs, max_pall, max_lbs, origin_idx):
+    """Build a single ant's tour, returns the path as point indices and its length"""
+    n_points = dist_mat.shape[0]
+    visited = np.zeros(n_points, dtype=np.bool_)
+    probabilities = np.empty(n_points)
+    path = np.empty(2 * n_points + 1, dtype=np.int64)
+
+    # The origin is only re-entered on capacity overflow, never picked as a next stop
+    visited[origin_idx] = True
+
+    # Start from a random point (not origin)
+    current_point = origin_idx
+    while current_point == origin_idx:
+        current_point = np.random.randint(n_points)
+
+    visited[current_point] = True
+    remaining = n_points - 2
+    path[0] = origin_idx
+    path[1] = current_point
+    n_steps = 2
+    # Accumulated in float64 even though the matrices are float32
+    path_length = 0.0
+    path_length += dist_mat[origin_idx, current_point]
+    current_load = pall[current_point]
+    current_weight = lbs[current_point]
+
+    while remaining > 0:
+        probabilities[:] = pheromone_alpha[current_point] * inv_dist_beta[current_point]
+        probabilities[visited] = 0.0
+        cumulative = np.cumsum(probabilities)
+        total = cumulative[-1]
+
+        # Sample from the cumulative distribution, uniform over unvisited points if it is degenerate
+        if total > 0:
+            next_point = np.searchsorted(cumulative, np.random.random() * total, side='right')
+            if next_point == n_points:
+                # The draw rounded up to the total, take the last point with any weight
+                next_point = np.searchsorted(cumulative, total)
+        else:
+            unvisited = np.nonzero(~visited)[0]
+            next_point = unvisited[np.random.randint(len(unvisited))]
+
+        next_load = pall[next_point]
+        next_weight = lbs[next_point]
+
+        # Check capacity constraints, a stop that doesn't fit an empty tractor still gets its own route
+        if current_point != origin_idx and (current_load + next_load > max_pall or current_weight + next_weight > max_lbs):
+            # Return to origin and start new route
+            path[n_steps] = origin_idx
+            n_steps += 1
+            path_length += dist_mat[current_point, origin_idx]
+            current_point = origin_idx
+            current_load = 0.0
+            current_weight = 0.0
+        else:
+            # Add point to current route
+            path[n_steps] = next_point
+            n_steps += 1
+            current_load += next_load
+            current_weight += next_weight
+            path_length += dist_mat[current_point, next_point]
+            visited[next_point] = True
+            remaining -= 1
+            current_point = next_point
+
+    # Return to origin
+    path[n_steps] = origin_idx
+    n_steps += 1
+    path_length += dist_mat[current_point, origin_idx]
+
+    return path[:n_steps], path_length
+
+
+@njit('Tuple((int64[:, ::1], float64[::1]))(float32[:, ::1], float32[:, ::1], float32[:, ::1], float64[::1], float64[::1], float64, float64, int64, int64[::1])',
+      cache=True, parallel=True, fastmath=FASTMATH_FLAGS)
+def _build_all_ants(dist_mat, pheromone_alpha, inv_dist_beta, pall, lbs, max_pall, max_lbs, origin_idx, seeds):
+    """Build one tour per seed in parallel, paths are padded with -1"""
+    n_ants = len(seeds)
+    paths = np.full((n_ants, 2 * dist_mat.shape[0] + 1), -1, dtype=np.int64)
+    path_lengths = np.empty(n_ants)
+
+    for ant in prange(n_ants):
+        # Seeds the random state of the thread running this ant
+        np.random.seed(seeds[ant])
+        path, path_length = _build_ant_tour(dist_mat, pheromone_alpha, inv_dist_beta, pall, lbs, max_pall, max_lbs, origin_idx)
+        paths[ant, :len(path)] = path
+        path_lengths[ant] = path_length
+
+    return paths, path_lengths
+
+
+@njit('void(float32[:, ::1], int64[:, ::1], float64[::1], float64, float64)',
+      cache=True, fastmath=FASTMATH_FLAGS)
+def _update_pheromone(pheromone, paths, path_lengths, evaporation_rate, Q):
+    """Evaporate the pheromone and add what each ant laid along its path, in place"""
+    pheromone *= evaporation_rate
+
+    for ant in range(paths.shape[0]):
+        path = paths[ant]
+        deposit = Q / path_lengths[ant]
+        last = 0
+        while last + 1 < len(path) and path[last + 1] >= 0:
+            pheromone[path[last], path[last + 1]] += deposit
+            last += 1
+        pheromone[path[last], path[0]] += deposit
+
+
 class ACOSolver:
-    def __init__(self, dvrp_id, points_file, db_path, origin, max_pall, max_lbs, n_ants=30, n_iterations=50, alpha=1, beta=1, evaporation_rate=0.5, Q=1):
+    def __init__(self, dvrp_id, points_file, db_path, origin, max_pall, max_lbs, n_ants=30, n_iterations=50, alpha=1, beta=1, evaporation_rate=0.5, Q=1, seed=None):
         self.dvrp_id = dvrp_id
         self.points_file = points_file
         self.db_path = db_path
@@ -21,18 +145,15 @@ class ACOSolver:
         self.beta = float(beta)
         self.evaporation_rate = float(evaporation_rate)
         self.Q = float(Q)
+        self.rng = np.random.default_rng(seed)
 
-    def distance(self, point_a, point_b):
-        """Get distance between two points from pre-computed matrix"""
-        distance = self.perm_df.loc[point_a, point_b]
-        return distance
-
-    def load_best_path_id_p(self):
-        """Save the best solution to database"""
-        if self.best_path_id_p and self.best_path_id_p[-1] == self.origin:
-            self.best_path_id_p.pop()
+    def create_indexes(self):
+        """Create the indexes used by the solver and plot queries if missing"""
+        self.cur.execute('CREATE INDEX IF NOT EXISTS idx_perm_pair ON geo_permutations (id_1, id_2)')
+        self.cur.execute('CREATE INDEX IF NOT EXISTS idx_dvrp_set_cover ON dvrp_set (dvrp_id, cluster_id, sequence)')
 
-        cluster_l = []
+    def _route_rows(self):
+        """Yield the dvrp_set rows of the best path, starting a new cluster at each origin"""
         cluster_counter = 0
         sequence_n = 0
         for item in self.best_path_id_p:
@@ -40,23 +161,27 @@ class ACOSolver:
                 cluster_counter += 1
                 sequence_n = 1
             else:
-                cluster_l.append([
+                yield (
                     self.dvrp_id,
                     cluster_counter,
                     f'Tractor_{cluster_counter}',
                     item,
                     sequence_n
-                ])
+                )
                 sequence_n += 1
 
-        cluster_l = [x for x in cluster_l if x[3] != self.origin]
+    def load_best_path_id_p(self):
+        """Save the best solution to database"""
+        if self.best_path_id_p and self.best_path_id_p[-1] == self.origin:
+            self.best_path_id_p.pop()
 
-        self.cur.executemany(
-            'INSERT INTO dvrp_set (dvrp_id, cluster_id, cluster_name, point, sequence) VALUES (?, ?, ?, ?, ?)',
-            cluster_l
-        )
-        self.cur.execute('INSERT INTO dvrp_origin (dvrp_id, dvrp_origin) VALUES (?, ?)', [self.dvrp_id, self.origin])
-        self.con.commit()
+        # Routes and origin go in as a single transaction, rows are streamed into the prepared insert
+        with self.con:
+            self.cur.executemany(
+                'INSERT INTO dvrp_set (dvrp_id, cluster_id, cluster_name, point, sequence) VALUES (?, ?, ?, ?, ?)',
+                self._route_rows()
+            )
+            self.cur.execute('INSERT INTO dvrp_origin (dvrp_id, dvrp_origin) VALUES (?, ?)', [self.dvrp_id, self.origin])
 
     def solve(self):
         """Run the ACO algorithm to solve CVRP"""
@@ -68,6 +193,13 @@ class ACOSolver:
         self.con = sqlite3.connect(self.db_path)
         self.cur = self.con.cursor()
 
+        # Bulk writes below don't need to hit the disk on every statement
+        self.cur.execute('PRAGMA synchronous=OFF')
+        self.cur.execute('PRAGMA journal_mode=MEMORY')
+        self.cur.execute('PRAGMA temp_store=MEMORY')
+
+        self.create_indexes()
+
         # Check if solution already exists
         dvrp_id_query = '''
             SELECT EXISTS (
@@ -83,125 +215,86 @@ class ACOSolver:
             self.con.close()
             return f'Solution {self.dvrp_id} already exists'
 
-        # Load points data
-        self.cur.execute('CREATE TEMPORARY TABLE IF NOT EXISTS temp_items (item TEXT)')
-        self.cur.execute('DELETE FROM temp_items')
-        self.cur.executemany('INSERT INTO temp_items (item) VALUES (?)', [(item,) for item in in_points])
-
+        # Load points data, chunked to stay under SQLite's bound parameter limit
         points_query = '''
-            SELECT gp.id_p, gp.pall_avg, gp.lbs_avg
-            FROM geo_points gp, temp_items tp
-            WHERE gp.id_p = tp.item
+            SELECT id_p, pall_avg, lbs_avg
+            FROM geo_points
+            WHERE id_p IN ({placeholders})
         '''
 
-        self.points_df = pd.read_sql_query(points_query, self.con)
+        self.points_df = pd.concat([
+            pd.read_sql_query(points_query.format(placeholders=','.join('?' * len(chunk))), self.con, params=chunk)
+            for chunk in _chunked(in_points, SQLITE_MAX_VARIABLES)
+        ], ignore_index=True)
+
+        # Point columns as contiguous arrays indexed by position, so the ant loop never goes through pandas
+        self._ids = self.points_df['id_p'].to_numpy()
+        self._pall = np.ascontiguousarray(self.points_df['pall_avg'].to_numpy(dtype=np.float64))
+        self._lbs = np.ascontiguousarray(self.points_df['lbs_avg'].to_numpy(dtype=np.float64))
 
-        # Load permutations data
+        # Load permutations data between the selected points only
         perm_query = '''
             SELECT id_1, id_2, distance
             FROM geo_permutations
+            WHERE id_1 IN ({placeholders_1}) AND id_2 IN ({placeholders_2})
         '''
 
-        perm_df = pd.read_sql_query(perm_query, self.con)
-        self.perm_df = perm_df.pivot(index='id_1', columns='id_2', values='distance')
+        perm_chunk_size = SQLITE_MAX_VARIABLES // 2
+        perm_df = pd.concat([
+            pd.read_sql_query(
+                perm_query.format(placeholders_1=','.join('?' * len(chunk_1)), placeholders_2=','.join('?' * len(chunk_2))),
+                self.con,
+                params=[*chunk_1, *chunk_2]
+            )
+            for chunk_1 in _chunked(self._ids, perm_chunk_size)
+            for chunk_2 in _chunked(self._ids, perm_chunk_size)
+        ], ignore_index=True)
 
         n_points = len(self.points_df)
-        pheromone = np.ones((n_points, n_points))
+
+        # Pairs missing from geo_permutations are unreachable
+        id_to_idx = {id_p: i for i, id_p in enumerate(self._ids)}
+        # float32 halves the memory traffic of both n x n matrices, the ACO doesn't need more precision
+        dist_mat = np.full((n_points, n_points), np.inf, dtype=np.float32)
+        dist_mat[
+            perm_df['id_1'].map(id_to_idx).to_numpy(),
+            perm_df['id_2'].map(id_to_idx).to_numpy()
+        ] = perm_df['distance'].to_numpy(dtype=np.float32)
+        np.fill_diagonal(dist_mat, 0.0)
+
+        # The distance term of the attractiveness never changes, so it is raised to beta only once
+        inv_dist_beta = np.zeros_like(dist_mat)
+        np.power(dist_mat, -self.beta, out=inv_dist_beta, where=dist_mat > 0)
+
+        pheromone = np.ones((n_points, n_points), dtype=np.float32)
+        pheromone_alpha = np.empty_like(pheromone)
         best_path = None
         best_path_length = np.inf
-        self.origin_index = self.points_df[self.points_df['id_p'] == self.origin].index[0]
+        self.origin_index = id_to_idx[self.origin]
 
         print(f"🐜 Starting ACO with {n_points} points, {self.n_ants} ants, {self.n_iterations} iterations")
 
         for iteration in tqdm(range(self.n_iterations), desc="ACO Iterations"):
-            paths = []
-            path_lengths = []
-
-            for ant in range(self.n_ants):
-                visited = [False] * n_points
-
-                # Start from a random point (not origin)
-                while True:
-                    current_point = np.random.randint(n_points)
-                    if self.points_df.iloc[current_point, 0] != self.origin:
-                        break
-
-                visited[current_point] = True
-                path = [self.origin_index, current_point]
-                point_a = self.points_df.iloc[self.origin_index, 0]
-                point_b = self.points_df.iloc[current_point, 0]
-                path_length = self.distance(point_a, point_b)
-                current_load = self.points_df.iloc[current_point, 1]
-                current_weight = self.points_df.iloc[current_point, 2]
-
-                while False in visited:
-                    unvisited = np.where(np.logical_not(visited))[0]
-                    probabilities = np.zeros(len(unvisited))
-
-                    for i, unvisited_point in enumerate(unvisited):
-                        point_a = self.points_df.iloc[current_point, 0]
-                        point_b = self.points_df.iloc[unvisited_point, 0]
-                        dist = self.distance(point_a, point_b)**self.beta
-                        pheromone_value = pheromone[current_point, unvisited_point]**self.alpha
-                        probabilities[i] = pheromone_value / dist
-
-                    p_sum = np.sum(probabilities)
-                    if p_sum > 0:
-                        probabilities /= p_sum
-                    else:
-                        probabilities = np.ones(len(probabilities)) / len(probabilities)
-
-                    next_point = np.random.choice(unvisited, p=probabilities)
-                    if self.points_df.iloc[next_point, 0] == self.origin:
-                        continue
-
-                    next_load = self.points_df.iloc[next_point, 1]
-                    next_weight = self.points_df.iloc[next_point, 2]
-
-                    # Check capacity constraints
-                    if current_load + next_load > self.max_pall or current_weight + next_weight > self.max_lbs:
-                        # Return to origin and start new route
-                        path.append(self.origin_index)
-                        point_a = self.points_df.iloc[current_point, 0]
-                        point_b = self.points_df.iloc[self.origin_index, 0]
-                        path_length += self.distance(point_a, point_b)
-                        visited[self.origin_index] = True
-                        current_point = self.origin_index
-                        current_load = 0
-                        current_weight = 0
-                    else:
-                        # Add point to current route
-                        path.append(next_point)
-                        current_load += next_load
-                        current_weight += next_weight
-                        point_a = self.points_df.iloc[current_point, 0]
-                        point_b = self.points_df.iloc[next_point, 0]
-                        path_length += self.distance(point_a, point_b)
-                        visited[next_point] = True
-                        current_point = next_point
-
-                # Return to origin
-                path.append(self.origin_index)
-                paths.append(path)
-                point_a = self.points_df.iloc[current_point, 0]
-                point_b = self.points_df.iloc[self.origin_index, 0]
-                path_length += self.distance(point_a, point_b)
-                path_lengths.append(path_length)
-
-                if path_length < best_path_length:
-                    best_path = path
-                    best_path_length = path_length
+            # Pheromone only changes between iterations, raise it to alpha once for all ants
+            np.power(pheromone, self.alpha, out=pheromone_alpha)
 
-            # Update pheromones
-            pheromone *= self.evaporation_rate
+            # Ants are independent, only the pheromone update has to wait for all of them
+            seeds = self.rng.integers(2**31 - 1, size=self.n_ants)
+            paths, path_lengths = _build_all_ants(
+                dist_mat, pheromone_alpha, inv_dist_beta, self._pall, self._lbs,
+                float(self.max_pall), float(self.max_lbs), self.origin_index, seeds
+            )
 
-            for path, path_length in zip(paths, path_lengths):
-                for i in range(len(path)-1):
-                    pheromone[path[i], path[i + 1]] += self.Q / path_length
-                pheromone[path[-1], path[0]] += self.Q / path_length
+            best_ant = np.argmin(path_lengths)
+            if path_lengths[best_ant] < best_path_length:
+                best_path = paths[best_ant][paths[best_ant] >= 0]
+                best_path_length = path_lengths[best_ant]
+
+            # Update pheromones
+            _update_pheromone(pheromone, paths, path_lengths, self.evaporation_rate, self.Q)
 
         print(f"\\n✅ Best solution found with total distance: {best_path_length:.2f} meters")
-        self.best_path_id_p = [self.points_df.iloc[i, 0] for i in best_path]
+        self.best_path_id_p = self._ids[best_path].tolist()
         print(f"📍 Route points: {len([p for p in self.best_path_id_p if p != self.origin])} stores visited")
 
         self.load_best_path_id_p()
@@ -2,24 +2,30 @@ import plotly.graph_objects as go
 import plotly.figure_factory as ff
 import pandas as pd
 import sqlite3
+import hashlib
+import json
+import zlib
 
 # Version identifier for debugging module reloads
-__version__ = "2.2.0"
+__version__ = "2.5.0"
 print(f"🔧 Loading plots.py version {__version__}")
 
 
-def plot_solution_table(dvrp_id, db_path='data/cvrp_demo.db'):
+def plot_solution_table(dvrp_id, db_path='data/cvrp_demo.db', con=None):
     """
     Create a table showing the solution routes
 
     Args:
         dvrp_id: Solution identifier
         db_path: Path to database file
+        con: Open database connection to reuse instead of connecting to db_path
 
     Returns:
         plotly figure object
     """
-    con = sqlite3.connect(db_path)
+    own_con = con is None
+    if own_con:
+        con = sqlite3.connect(db_path)
 
     # Get solution data
     routes_query = """
@@ -38,7 +44,8 @@ def plot_solution_table(dvrp_id, db_path='data/cvrp_demo.db'):
     """
 
     routes_df = pd.read_sql_query(routes_query, con, params=[dvrp_id])
-    con.close()
+    if own_con:
+        con.close()
 
     if routes_df.empty:
         # Create empty table
@@ -56,9 +63,10 @@ def plot_solution_table(dvrp_id, db_path='data/cvrp_demo.db'):
         total_weight = tractor_data['weight_lbs'].sum()
 
         # Build route description
-        stops = []
-        for _, stop in tractor_data.iterrows():
-            stops.append(f"{stop['store_name']} ({stop['pallets']}p, {stop['weight_lbs']:.0f}lbs)")
+        stops = [
+            f"{stop.store_name} ({stop.pallets}p, {stop.weight_lbs:.0f}lbs)"
+            for stop in tractor_data.itertuples(index=False)
+        ]
 
         route_desc = " → ".join(stops)
 
@@ -97,7 +105,37 @@ def plot_solution_table(dvrp_id, db_path='data/cvrp_demo.db'):
     return fig
 
 
-def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db'):
+def _get_ors_route(ors_client, coords_list, con):
+    """
+    Get a road route from ORS, cached in the ors_cache table
+
+    Args:
+        ors_client: openrouteservice client
+        coords_list: Route coordinates as [lon, lat] pairs
+        con: Open connection to the database holding the cache
+
+    Returns:
+        GeoJSON route as returned by ORS
+    """
+    key = hashlib.sha1(json.dumps(coords_list).encode()).hexdigest()
+    cached = con.execute("SELECT geojson FROM ors_cache WHERE key = ?", [key]).fetchone()
+    if cached:
+        return json.loads(zlib.decompress(cached[0]))
+
+    route = ors_client.directions(
+        coordinates=coords_list,
+        profile='driving-hgv',
+        format='geojson'
+    )
+    with con:
+        con.execute(
+            "INSERT OR REPLACE INTO ors_cache (key, geojson) VALUES (?, ?)",
+            [key, zlib.compress(json.dumps(route).encode())]
+        )
+    return route
+
+
+def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db', con=None):
     """
     Create an interactive map showing delivery routes
 
@@ -105,6 +143,7 @@ def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db'):
         dvrp_id: Solution identifier
         ors_api_key: Open Route Service API key (optional, will try Colab secrets)
         db_path: Path to database file
+        con: Open database connection to reuse instead of connecting to db_path
 
     Returns:
         plotly figure object
@@ -129,7 +168,9 @@ def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db'):
             print("="*80 + "\n")
             ors_api_key = None
     
-    con = sqlite3.connect(db_path)
+    own_con = con is None
+    if own_con:
+        con = sqlite3.connect(db_path)
 
     # Get route data
     routes_query = """
@@ -165,9 +206,9 @@ def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db'):
     else:
         dc_lat, dc_lon = 40.7505, -73.9934  # Default to Manhattan
 
-    con.close()
-
     if routes_df.empty:
+        if own_con:
+            con.close()
         # Create empty map centered on Manhattan
         fig = go.Figure()
         fig.add_trace(go.Scattermapbox(
@@ -202,6 +243,10 @@ def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db'):
             print("Falling back to straight-line routes")
             ors_client = None
 
+    # ORS responses are cached in the database so re-rendering doesn't hit the API again
+    if ors_client:
+        con.execute("CREATE TABLE IF NOT EXISTS ors_cache (key TEXT PRIMARY KEY, geojson BLOB)")
+
     # Plot routes for each tractor
     for tractor_id, tractor_data in routes_df.groupby('cluster_id'):
         color = colors[tractor_id % len(colors)]
@@ -210,26 +255,22 @@ def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db'):
         # Build coordinates list for this route
         coords_list = [[float(dc_lon), float(dc_lat)]]  # Start at DC (lon, lat for ORS)
         
-        for _, stop in tractor_data.iterrows():
-            coords_list.append([float(stop['lon']), float(stop['lat'])])
+        for stop in tractor_data.itertuples(index=False):
+            coords_list.append([float(stop.lon), float(stop.lat)])
         
         coords_list.append([float(dc_lon), float(dc_lat)])  # Return to DC
         
         print(f"🚛 {tractor_name} route coordinates: {coords_list}")
         
         # Print store sequence for this tractor
-        store_names = [stop['store_name'] for _, stop in tractor_data.iterrows()]
+        store_names = tractor_data['store_name'].tolist()
         print(f"🏪 {tractor_name} stops: {', '.join(store_names)}")
 
         # Get route line coordinates
         if ors_client:
             # Use ORS to get realistic road routes
             try:
-                route = ors_client.directions(
-                    coordinates=coords_list,
-                    profile='driving-hgv',
-                    format='geojson'
-                )
+                route = _get_ors_route(ors_client, coords_list, con)
                 # Extract coordinates from GeoJSON
                 line_coords = route['features'][0]['geometry']['coordinates']
                 # Convert to (lat, lon) for Plotly
@@ -257,25 +298,26 @@ def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db'):
             hoverinfo='name'
         ))
 
-        # Plot store markers with sequence numbers
-        for i, stop in enumerate(tractor_data.iterrows()):
-            _, stop_data = stop
-            sequence_num = i + 1  # Stop sequence in this route
-            fig.add_trace(go.Scattermapbox(
-                lat=[stop_data['lat']],
-                lon=[stop_data['lon']],
-                mode='markers+text',
-                marker=dict(size=12, color=color),
-                text=[f"Stop {sequence_num}"],
-                textposition="top center",
-                name=f'{tractor_name} Stop {sequence_num}: {stop_data["store_name"]}',
-                hovertemplate=f"<b>Stop {sequence_num}</b><br>" +
-                             f"{stop_data['store_name']}<br>" +
-                             f"Pallets: {stop_data['pallets']}<br>" +
-                             f"Weight: {stop_data['weight_lbs']:,.0f} lbs<br>" +
-                             "<extra></extra>",
-                showlegend=False
-            ))
+        # Plot store markers with sequence numbers, one trace for all stops of this tractor
+        hover_texts = [
+            f"<b>Stop {sequence_num}</b><br>"
+            f"{stop.store_name}<br>"
+            f"Pallets: {stop.pallets}<br>"
+            f"Weight: {stop.weight_lbs:,.0f} lbs"
+            for sequence_num, stop in enumerate(tractor_data.itertuples(index=False), start=1)
+        ]
+        fig.add_trace(go.Scattermapbox(
+            lat=tractor_data['lat'].tolist(),
+            lon=tractor_data['lon'].tolist(),
+            mode='markers+text',
+            marker=dict(size=12, color=color),
+            text=[f"Stop {sequence_num}" for sequence_num in range(1, len(tractor_data) + 1)],
+            textposition="top center",
+            name=f'{tractor_name} Stops',
+            hovertext=hover_texts,
+            hovertemplate="%{hovertext}<extra></extra>",
+            showlegend=False
+        ))
 
     # Plot distribution center with better visibility
     print(f"🏭 Distribution Center coordinates: [{dc_lon}, {dc_lat}]")
@@ -294,6 +336,9 @@ def plot_routes_map(dvrp_id, ors_api_key=None, db_path='data/cvrp_demo.db'):
         showlegend=True
     ))
 
+    if own_con:
+        con.close()
+
     # Configure map
     fig.update_layout(
         mapbox_style="open-street-map",